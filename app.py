@@ -1,15 +1,24 @@
 #app.py
 from functools import wraps
-from flask import Flask, request, jsonify
+from contextlib import contextmanager
+from flask import Flask, Response, g, has_request_context, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from flask_marshmallow import Marshmallow
 from marshmallow import ValidationError
-from sqlalchemy import Float, ForeignKey, Table, String, Column, UniqueConstraint, select, exc, DateTime
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy import Float, ForeignKey, Table, String, Column, UniqueConstraint, Select, select, exists, insert, update, delete, exc, event, DateTime
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, make_transient_to_detached, selectinload
 from sqlalchemy.sql import func
 from typing import List, Optional
 import uuid
+import base64, hashlib
 import json, jwt
+import threading, time
+import multiprocessing, os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict, defaultdict
 from datetime import datetime, timedelta, timezone
 from  werkzeug.security import generate_password_hash, check_password_hash
 
@@ -18,17 +27,74 @@ app = Flask(__name__)
 
 #JWT token 
 app.config['SECRET_KEY'] = 'my super secret key'
+# how many decoded identities token_required keeps per worker and for how long (seconds)
+app.config['IDENTITY_CACHE_SIZE'] = 1024
+app.config['IDENTITY_CACHE_TTL'] = 60
+# cursor pagination (?after=<cursor>&limit=N) page size and server side cap
+app.config['CURSOR_PAGE_DEFAULT_LIMIT'] = 20
+app.config['CURSOR_PAGE_MAX_LIMIT'] = 100
+# rows fetched per round trip and per chunk when a list route streams NDJSON
+app.config['STREAM_BATCH_SIZE'] = 500
+# largest array accepted by the batch endpoints
+app.config['BATCH_MAX_ITEMS'] = 1000
+# serialized product payloads kept per worker, other workers' writes show up once an entry expires (seconds)
+app.config['PRODUCT_CACHE_SIZE'] = 512
+app.config['PRODUCT_CACHE_TTL'] = 30
+# password hashing runs in its own processes, requests beyond pool size + queue size get a 503
+app.config['HASH_POOL_SIZE'] = os.cpu_count() or 1
+app.config['HASH_QUEUE_SIZE'] = 32
+app.config['HASH_RETRY_AFTER'] = 1
+# full werkzeug method string, stored hashes made with anything else are rehashed on login
+app.config['PASSWORD_HASH_METHOD'] = 'scrypt:32768:8:1'
+# /metrics latency histogram buckets (seconds) and when a request gets logged as slow
+app.config['METRICS_BUCKETS'] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+app.config['SLOW_REQUEST_QUERIES'] = 20
+app.config['SLOW_REQUEST_SECONDS'] = 1.0
 
 # MySQL database configuration
 app.config['SQLALCHEMY_DATABASE_URI'] = 'mysql+mysqlconnector://root:<password>@localhost/flask_api_db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# same database through an asyncio driver, used by the ASGI entry point in asgi_app.py
+app.config['ASYNC_DATABASE_URI'] = 'mysql+aiomysql://root:<password>@localhost/flask_api_db'
+# connection pool tuning, None keeps SQLAlchemy's default for that setting
+app.config['DB_POOL_SIZE'] = None
+app.config['DB_MAX_OVERFLOW'] = None
+app.config['DB_POOL_PRE_PING'] = True
+app.config['DB_POOL_RECYCLE'] = 3600
+# read only routes query this database when set, except for clients that wrote
+# within the last REPLICA_STICKY_SECONDS so they always read their own writes
+app.config['DATABASE_REPLICA_URI'] = None
+app.config['REPLICA_STICKY_SECONDS'] = 5
+
+# any setting above can be overridden from the environment with a FLASK_ prefix,
+# e.g. FLASK_SQLALCHEMY_DATABASE_URI=sqlite:///local.db
+app.config.from_prefixed_env()
+
+pool_options = {
+    'pool_size': app.config['DB_POOL_SIZE'],
+    'max_overflow': app.config['DB_MAX_OVERFLOW'],
+    'pool_pre_ping': app.config['DB_POOL_PRE_PING'],
+    'pool_recycle': app.config['DB_POOL_RECYCLE'],
+}
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {key: value for key, value in pool_options.items() if value is not None}
+if app.config['DATABASE_REPLICA_URI']:
+    app.config['SQLALCHEMY_BINDS'] = {'replica': {'url': app.config['DATABASE_REPLICA_URI'], **app.config['SQLALCHEMY_ENGINE_OPTIONS']}}
+
+# sends SELECTs to the replica bind during requests marked by read_replica,
+# everything else (and anything flushed) goes to the primary
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and isinstance(clause, Select)
+                and has_request_context() and g.get('use_replica')):
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
 
 #Creating our Base Model
 class Base(DeclarativeBase):
     pass
 
 # Initialize SQLAlchemy and Marshmallow
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 db.init_app(app)
 ma = Marshmallow(app)
 
@@ -37,7 +103,7 @@ order_product = Table(
 	"order_product",
 	Base.metadata,
 	Column("order_id", ForeignKey("orders.id")),
-	Column("product_id", ForeignKey("products.id")),
+	Column("product_id", ForeignKey("products.id"), index=True),
     UniqueConstraint('order_id', 'product_id', name='unique_product_order')
 )
 
@@ -58,7 +124,7 @@ class Order(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     order_date: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
 		
     #Many-to-Many relationship
     products: Mapped[List["Product"]] = relationship(secondary=order_product, back_populates="orders_to_product")
@@ -69,25 +135,136 @@ class Product(Base):
     __tablename__ = "products"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    product_name: Mapped[Optional[str]] = mapped_column(String(200))
-    price: Mapped[float] = mapped_column(Float)
+    product_name: Mapped[Optional[str]] = mapped_column(String(200), index=True)
+    price: Mapped[float] = mapped_column(Float, index=True)
 		
     #Many-to-Many relationship
     orders_to_product: Mapped[List["Order"]] = relationship(secondary=order_product, back_populates="products")
 
+# Running order count and spend per user, kept up to date by the order and
+# product routes so /users/<id>/summary never scans the user's history
+class UserSummary(Base):
+    __tablename__ = "user_summaries"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    order_count: Mapped[int] = mapped_column(default=0)
+    total_spend: Mapped[float] = mapped_column(Float, default=0)
+
+#======== Instrumentation ========
+# Per request timings (sql, serialize, auth) are collected on g and folded into
+# per route totals when the request is torn down, /metrics renders them for Prometheus.
+class Metrics:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.requests = defaultdict(lambda: {'count': 0, 'sum': 0.0, 'buckets': [0] * len(buckets)})
+        self.totals = defaultdict(float)
+
+    def observe(self, route, method, seconds, timings):
+        with self._lock:
+            histogram = self.requests[(route, method)]
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+            for part, value in timings.items():
+                self.totals[(part, route, method)] += value
+
+    def render(self):
+        lines = ['# TYPE http_request_duration_seconds histogram']
+        with self._lock:
+            for (route, method), histogram in sorted(self.requests.items()):
+                labels = f'route="{route}",method="{method}"'
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+                lines.append(f'http_request_duration_seconds_sum{{{labels}}} {histogram["sum"]}')
+                lines.append(f'http_request_duration_seconds_count{{{labels}}} {histogram["count"]}')
+            for name in ('sql_statements', 'sql_seconds', 'serialize_seconds', 'auth_seconds'):
+                lines.append(f'# TYPE {name}_total counter')
+                for (part, route, method), value in sorted(self.totals.items()):
+                    if part == name:
+                        value = int(value) if name == 'sql_statements' else value
+                        lines.append(f'{name}_total{{route="{route}",method="{method}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics(app.config['METRICS_BUCKETS'])
+
+# adds the time spent inside the block to this request's timing for part
+@contextmanager
+def timed(part):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context() and 'timings' in g:
+            g.timings[part] += time.perf_counter() - start
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.timings = defaultdict(float)
+
+# teardown rather than after_request so queries run by a streamed body are counted
+@app.teardown_request
+def record_request_metrics(error=None):
+    if 'request_start' not in g:
+        return
+    seconds = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe(route, request.method, seconds, g.timings)
+    queries = int(g.timings['sql_statements'])
+    if queries > app.config['SLOW_REQUEST_QUERIES'] or seconds > app.config['SLOW_REQUEST_SECONDS']:
+        app.logger.warning("slow request %s %s: %.3fs, %d queries (%.3fs sql)", request.method, route, seconds, queries, g.timings['sql_seconds'])
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context() and 'timings' in g:
+        g.timings['sql_statements'] += 1
+        g.timings['sql_seconds'] += elapsed
+
+# after_cursor_execute does not run for a statement that raised, drop its start time
+# here or it stays on the pooled connection for good
+def handle_error(context):
+    if context.execution_context is not None and context.connection.info.get('query_start'):
+        context.connection.info['query_start'].pop()
+
+with app.app_context():
+    for engine in db.engines.values():
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(engine, 'handle_error', handle_error)
+
+# JSON encoding counts towards serialization time along with the schema dumps below
+class TimedJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        with timed('serialize_seconds'):
+            return super().dumps(obj, **kwargs)
+
+app.json = TimedJSONProvider(app)
+
+class TimedSchema:
+    def dump(self, obj, *, many=None):
+        with timed('serialize_seconds'):
+            return super().dump(obj, many=many)
+
 #=======  Schemas ========
 # User Schema
-class UserSchema(ma.SQLAlchemyAutoSchema):
+class UserSchema(TimedSchema, ma.SQLAlchemyAutoSchema):
     class Meta:
         model = User
         
 # Order Schema
-class OrderSchema(ma.SQLAlchemyAutoSchema):
+class OrderSchema(TimedSchema, ma.SQLAlchemyAutoSchema):
     class Meta:
         model = Order
 
 # Product Schema
-class ProductSchema(ma.SQLAlchemyAutoSchema):
+class ProductSchema(TimedSchema, ma.SQLAlchemyAutoSchema):
     class Meta:
         model = Product
 
@@ -99,6 +276,95 @@ orders_schema = OrderSchema(many=True)
 product_schema = ProductSchema()
 products_schema = ProductSchema(many=True)
 
+#======== Read Replica ========
+# decorator for read only routes, their queries go to the replica unless this
+# client wrote recently (see remember_primary_reads)
+def read_replica(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if 'replica' in app.config.get('SQLALCHEMY_BINDS', {}):
+            g.use_replica = not reads_primary()
+        return f(*args, **kwargs)
+    return decorated
+
+# cookies defaults to this request's cookies
+def reads_primary(cookies=None):
+    cookies = request.cookies if cookies is None else cookies
+    try:
+        return float(cookies.get('read_primary_until', 0)) > time.time()
+    except ValueError:
+        return False
+
+@event.listens_for(RoutingSession, 'after_flush')
+def flushed_write(session, flush_context):
+    if has_request_context():
+        g.wrote = True
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def executed_write(orm_execute_state):
+    if has_request_context() and (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        g.wrote = True
+
+# after a write the client reads from the primary for REPLICA_STICKY_SECONDS
+@app.after_request
+def remember_primary_reads(response):
+    if g.get('wrote') and 'replica' in app.config.get('SQLALCHEMY_BINDS', {}):
+        window = app.config['REPLICA_STICKY_SECONDS']
+        response.set_cookie('read_primary_until', str(time.time() + window), max_age=window, httponly=True)
+    return response
+
+#======== Identity Cache ========
+# Bounded LRU of token -> detached User so token_required can skip the User lookup.
+# Entries never outlive the token's exp and are dropped when the user's public_id
+# is rotated or the user is deleted. Counters are per worker process.
+class IdentityCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, token, exp, user):
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        with self._lock:
+            self._entries[token] = (expires_at, user.public_id, user)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, public_id):
+        with self._lock:
+            for token in [t for t, entry in self._entries.items() if entry[1] == public_id]:
+                del self._entries[token]
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+identity_cache = IdentityCache(app.config['IDENTITY_CACHE_SIZE'], app.config['IDENTITY_CACHE_TTL'])
+
+# copy of a loaded user that can outlive the request session
+def detached_user(user):
+    copy = User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+    make_transient_to_detached(copy)
+    return copy
+
 # decorator for verifying the JWT
 def token_required(f):
     @wraps(f)
@@ -112,10 +378,19 @@ def token_required(f):
             return jsonify({'message' : 'Token is missing !!'}), 401
   
         try:
-            # decoding the payload to fetch the stored details
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            query = select(User).where(User.public_id == data['public_id'])
-            current_user = db.session.execute(query).scalars().first()
+            with timed('auth_seconds'):
+                # decoding the payload to fetch the stored details
+                data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+                cached_user = identity_cache.get(token)
+                if cached_user is not None:
+                    # a detached copy, not merged: merging would put the cached columns in the
+                    # session's identity map and db.session.get(User, id) in the routes would return them
+                    current_user = detached_user(cached_user)
+                else:
+                    query = select(User).where(User.public_id == data['public_id'])
+                    current_user = db.session.execute(query).scalars().first()
+                    if current_user is not None:
+                        identity_cache.put(token, data.get('exp'), detached_user(current_user))
         except:
             return jsonify({
                 'message' : 'Token is invalid !!'
@@ -125,6 +400,334 @@ def token_required(f):
   
     return decorated
 
+#======== Cursor Pagination ========
+# opaque cursor wrapping the last primary key a client has seen
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(json.dumps({'id': last_id}).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode()))['id'])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError(f"Invalid cursor {cursor}")
+
+def is_cursor_request():
+    return 'after' in request.args or 'limit' in request.args
+
+# seeks past ?after= on the primary key instead of using OFFSET, the COUNT only runs with ?count=1
+def keyset_page(query, id_column):
+    try:
+        limit = int(request.args.get('limit', app.config['CURSOR_PAGE_DEFAULT_LIMIT']))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    limit = max(1, min(limit, app.config['CURSOR_PAGE_MAX_LIMIT']))
+    meta = {}
+    if request.args.get('count') in ('1', 'true'):
+        meta['total'] = db.session.execute(select(func.count()).select_from(query.order_by(None).subquery())).scalar()
+    after = request.args.get('after')
+    if after:
+        query = query.where(id_column > decode_cursor(after))
+    # one extra row tells us whether there is a next page
+    items = db.session.execute(query.limit(limit + 1)).scalars().all()
+    meta['next'] = encode_cursor(items[limit - 1].id) if len(items) > limit else None
+    return items[:limit], meta
+
+#======== Product Search ========
+# ?q=<name prefix>&min_price=&max_price=&sort=price|-price|id as range predicates
+# and orderings the product_name and price indexes can answer without a scan
+PRODUCT_SORTS = {
+    'id': (Product.id,),
+    'price': (Product.price, Product.id),
+    '-price': (Product.price.desc(), Product.id.desc()),
+}
+
+# args defaults to this request's query string
+def filter_products(query, args=None):
+    args = request.args if args is None else args
+    q = args.get('q')
+    if q:
+        # LIKE 'q%' with % and _ in q escaped, MySQL range scans the product_name index for it
+        query = query.where(Product.product_name.startswith(q, autoescape=True))
+    try:
+        if args.get('min_price'):
+            query = query.where(Product.price >= float(args['min_price']))
+        if args.get('max_price'):
+            query = query.where(Product.price <= float(args['max_price']))
+    except ValueError:
+        raise ValueError("min_price and max_price must be numbers")
+    sort = args.get('sort', 'id')
+    if sort not in PRODUCT_SORTS:
+        raise ValueError(f"Cannot sort by {sort}")
+    return query.order_by(*PRODUCT_SORTS[sort])
+
+#======== Streaming ========
+def is_stream_request():
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+# one JSON object per line, read with yield_per so memory stays flat however many rows there are
+def stream_ndjson(query, serialize):
+    batch_size = app.config['STREAM_BATCH_SIZE']
+
+    def generate():
+        lines = []
+        for row in db.session.execute(query.execution_options(yield_per=batch_size)).scalars():
+            # compact separators, like the JSON list responses
+            lines.append(app.json.dumps(serialize(row), separators=(',', ':')))
+            if len(lines) >= batch_size:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+#======== Fast Serialization ========
+# Hot list routes select only the columns they return as row tuples and build
+# the same dicts the schemas would, then encode with orjson when it is installed.
+# The bytes match jsonify's exactly; anything orjson would format differently
+# (pretty printing, non-ASCII text, exponent floats) goes through jsonify instead.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+USER_COLUMNS = (User.public_id, User.name, User.email, User.address)
+PRODUCT_COLUMNS = (Product.id, Product.product_name, Product.price)
+ORDER_COLUMNS = (Order.id, Order.order_date)
+
+# the *_dicts builders take any iterable of row tuples, the *_rows helpers run the query first
+def user_dicts(rows):
+    return [{'public_id': public_id, 'name': name, 'email': email, 'address': address}
+            for public_id, name, email, address in rows]
+
+def product_dicts(rows):
+    return [{'id': id, 'product_name': product_name, 'price': None if price is None else float(price)}
+            for id, product_name, price in rows]
+
+def order_dicts(rows):
+    return [{'id': id, 'order_date': None if order_date is None else order_date.isoformat()}
+            for id, order_date in rows]
+
+def user_rows(query):
+    return user_dicts(db.session.execute(query))
+
+def product_rows(query):
+    return product_dicts(db.session.execute(query))
+
+def order_rows(query):
+    return order_dicts(db.session.execute(query))
+
+# same rows db.paginate(query, page=page, per_page=20, error_out=False).items returns, without its COUNT
+def page_of(query, page):
+    if not page:
+        return query
+    try:
+        page = int(page)
+    except ValueError:
+        raise ValueError("page must be an integer")
+    return query.limit(20).offset((max(page, 1) - 1) * 20)
+
+# floats that json.dumps and orjson write the same way
+def is_plain_float(value):
+    return value is None or value == 0 or 1e-4 <= abs(value) < 1e16
+
+def json_body(data, floats=()):
+    pretty = app.json.compact is None and app.debug or app.json.compact is False
+    if orjson is not None and not pretty and all(is_plain_float(value) for value in floats):
+        with timed('serialize_seconds'):
+            body = orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+        # orjson writes non-ASCII and DEL (0x7f) raw where jsonify escapes them
+        if body.isascii() and b'\x7f' not in body:
+            return body + b'\n'
+    return jsonify(data).get_data()
+
+def products_body(rows):
+    return json_body(rows, floats=[row['price'] for row in rows])
+
+def json_response(body):
+    return Response(body, mimetype=app.json.mimetype)
+
+#======== Password Hashing ========
+# werkzeug's KDFs are CPU bound on purpose, so they run on a process pool
+# instead of stalling every request queued behind a login on this worker
+class HashPoolBusy(Exception):
+    pass
+
+hash_pool = None
+hash_pool_lock = threading.Lock()
+hash_slots = threading.BoundedSemaphore(app.config['HASH_POOL_SIZE'] + app.config['HASH_QUEUE_SIZE'])
+
+def get_hash_pool():
+    global hash_pool
+    with hash_pool_lock:
+        if hash_pool is None:
+            hash_pool = ProcessPoolExecutor(app.config['HASH_POOL_SIZE'], mp_context=multiprocessing.get_context('spawn'))
+        return hash_pool
+
+# a pool whose worker died (e.g. OOM killed) fails every later call, drop it so the next call starts a new one
+def reset_hash_pool(broken):
+    global hash_pool
+    with hash_pool_lock:
+        if hash_pool is broken:
+            hash_pool = None
+    broken.shutdown(wait=False)
+
+def run_hash(fn, *args):
+    if not hash_slots.acquire(blocking=False):
+        raise HashPoolBusy()
+    try:
+        # retried once on a fresh pool, a second broken pool answers 503
+        for _ in range(2):
+            pool = get_hash_pool()
+            try:
+                return pool.submit(fn, *args).result()
+            except BrokenProcessPool:
+                reset_hash_pool(pool)
+        raise HashPoolBusy()
+    finally:
+        hash_slots.release()
+
+def hash_password(password):
+    return run_hash(generate_password_hash, password, app.config['PASSWORD_HASH_METHOD'])
+
+def verify_password(pwhash, password):
+    return run_hash(check_password_hash, pwhash, password)
+
+def needs_rehash(pwhash):
+    return pwhash.split('$', 1)[0] != app.config['PASSWORD_HASH_METHOD']
+
+@app.errorhandler(HashPoolBusy)
+def hash_pool_busy(e):
+    return jsonify({"message": "Too many password requests, try again shortly"}), 503, {'Retry-After': str(app.config['HASH_RETRY_AFTER'])}
+
+#======== Product Cache ========
+# Bounded LRU of serialized product responses keyed by ('product', id) or
+# ('products', query args), each stored with the strong ETag of its body.
+class ResponseCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def put(self, key, etag, body, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.time() + (self.ttl if ttl is None else ttl), etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, matches):
+        with self._lock:
+            for key in [key for key in self._entries if matches(key)]:
+                del self._entries[key]
+
+product_cache = ResponseCache(app.config['PRODUCT_CACHE_SIZE'], app.config['PRODUCT_CACHE_TTL'])
+
+# drops every list page and, when given, the entry for one product
+def invalidate_products(*ids):
+    ids = set(ids)
+    product_cache.invalidate(lambda key: key[0] == 'products' or (key[0] == 'product' and key[1] in ids))
+
+# serves the cached body for key, building it with load_body() on a miss; a matching
+# If-None-Match gets a 304 without touching the database
+def cached_json(key, load_body):
+    # clients that wrote recently read the primary (see read_replica), so they skip
+    # entries another client may have filled from a lagging replica
+    entry = None if reads_primary() else product_cache.get(key)
+    if entry is None:
+        body = load_body()
+        entry = (hashlib.sha256(body).hexdigest(), body)
+        # a replica body can miss a write made just before it, keep it no longer than
+        # the writer's sticky window so the writer does not read it once that ends
+        product_cache.put(key, *entry, ttl=min(product_cache.ttl, app.config['REPLICA_STICKY_SECONDS']) if g.get('use_replica') else None)
+    etag, body = entry
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+#======== Batch Requests ========
+# ?atomic=false writes the valid items and reports the rest, the default writes nothing unless every item is valid
+def is_atomic_batch():
+    return request.args.get('atomic', 'true') not in ('0', 'false')
+
+def check_batch(items):
+    if not isinstance(items, list):
+        return jsonify({"message": "Expected a JSON array"}), 400
+    if len(items) > app.config['BATCH_MAX_ITEMS']:
+        return jsonify({"message": f"At most {app.config['BATCH_MAX_ITEMS']} items per batch"}), 400
+    return None
+
+# 201 when every item was written, 207 when only some were, 400 when nothing was
+def batch_response(results, written):
+    failed = len(results) - written
+    if not failed:
+        status = 201
+    elif written:
+        status = 207
+    else:
+        status = 400
+    return jsonify({'written': written, 'failed': failed, 'results': results}), status
+
+#======== User Summaries ========
+# Every change is a relative UPDATE, so a user without a summary row yet (one that
+# existed before the table) is simply skipped and gets an exact row built from
+# their history the first time it is read.
+def add_orders(user_id, count):
+    db.session.execute(update(UserSummary).where(UserSummary.user_id == user_id)
+                       .values(order_count=UserSummary.order_count + count))
+
+def add_spend(user_id, amount):
+    db.session.execute(update(UserSummary).where(UserSummary.user_id == user_id)
+                       .values(total_spend=UserSummary.total_spend + amount))
+
+# moves every user who ordered product_id by delta for each line they have of it
+def reprice_spend(product_id, delta):
+    lines = (select(func.count()).select_from(order_product).join(Order, Order.id == order_product.c.order_id)
+             .where(order_product.c.product_id == product_id, Order.user_id == UserSummary.user_id)
+             .scalar_subquery())
+    buyers = select(Order.user_id).join(order_product, Order.id == order_product.c.order_id).where(order_product.c.product_id == product_id)
+    db.session.execute(update(UserSummary).where(UserSummary.user_id.in_(buyers))
+                       .values(total_spend=UserSummary.total_spend + delta * lines),
+                       execution_options={'synchronize_session': False})
+
+# summary rows built from the order history in the same statement that inserts them, so an
+# add_spend or reprice_spend committed meanwhile (which finds no row to update) is not lost
+def backfill_summaries(user_ids):
+    order_count = select(func.count()).select_from(Order).where(Order.user_id == User.id).scalar_subquery()
+    total_spend = (select(func.coalesce(func.sum(Product.price), 0))
+                   .select_from(Order).join(order_product, Order.id == order_product.c.order_id)
+                   .join(Product, Product.id == order_product.c.product_id)
+                   .where(Order.user_id == User.id).scalar_subquery())
+    missing = ~exists().where(UserSummary.user_id == User.id)
+    return insert(UserSummary).from_select(['user_id', 'order_count', 'total_spend'],
+                                           select(User.id, order_count, total_spend).where(User.id.in_(user_ids), missing))
+
+def user_summary(user_id):
+    summary = db.session.get(UserSummary, user_id)
+    if summary is not None:
+        return summary
+    try:
+        db.session.execute(backfill_summaries([user_id]))
+        db.session.commit()
+    except exc.IntegrityError as e:
+        # another request built it first
+        db.session.rollback()
+    # None when the user does not exist
+    return db.session.get(UserSummary, user_id)
+
 #======== User Routes =========
 # route for logging user in
 @app.route('/login', methods =['POST'])
@@ -142,7 +745,14 @@ def login():
         # returns 401 if user does not exist
         return jsonify({"message": f"User doesn't exist"}), 401
   
-    if check_password_hash(user.password, auth.get('password')):
+    if verify_password(user.password, auth.get('password')):
+        if needs_rehash(user.password):
+            # upgrade hashes made with older parameters while we have the plain password
+            try:
+                user.password = hash_password(auth.get('password'))
+                db.session.commit()
+            except HashPoolBusy:
+                pass
         # generates the JWT Token
         token = jwt.encode({
             'public_id': user.public_id,
@@ -160,9 +770,12 @@ def create_user():
     except ValidationError as e:
         return jsonify(e.messages), 400
     
+    password = hash_password(user_data['password'])
     try:
-        new_user = User(name=user_data['name'], address=user_data['address'], email=user_data['email'], password=generate_password_hash(user_data['password']), public_id=str(uuid.uuid4()))
+        new_user = User(name=user_data['name'], address=user_data['address'], email=user_data['email'], password=password, public_id=str(uuid.uuid4()))
         db.session.add(new_user)
+        db.session.flush()
+        db.session.add(UserSummary(user_id=new_user.id, order_count=0, total_spend=0))
         db.session.commit()
     except exc.IntegrityError as e:
         return jsonify({"message": f"Duplicate email {user_data['email']}"}), 400
@@ -175,29 +788,44 @@ def create_user():
         }), 201
 
 @app.route('/users', methods=['GET'])
+@read_replica
 @token_required
 def get_users(current_user):
     page = request.args.get('page')
     query = select(User).order_by(User.id)
-    if page:
-        users = db.paginate(query, page=int(page), per_page=20, error_out=False).items
-    else:
-        users = db.session.execute(query).scalars().all()
-    # converting the query objects
-    # to list of jsons
-    output = []
-    for user in users:
-        # appending the user data json 
-        # to the response list
-        output.append({
+    if is_cursor_request():
+        try:
+            users, meta = keyset_page(query, User.id)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        # converting the query objects
+        # to list of jsons
+        output = []
+        for user in users:
+            # appending the user data json 
+            # to the response list
+            output.append({
+                'public_id': user.public_id,
+                'name' : user.name,
+                'email' : user.email,
+                'address' : user.address
+            })
+        return jsonify({'items': users_schema.dump(output), **meta}), 200
+    if not page and is_stream_request():
+        return stream_ndjson(query, lambda user: user_schema.dump({
             'public_id': user.public_id,
             'name' : user.name,
             'email' : user.email,
             'address' : user.address
-        })
-    return users_schema.jsonify(output), 200
+        }))
+    try:
+        query = page_of(select(*USER_COLUMNS).order_by(User.id), page)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    return json_response(json_body(user_rows(query))), 200
 
 @app.route('/users/<int:id>', methods=['GET'])
+@read_replica
 @token_required
 def get_user(current_user, id):
     user = db.session.get(User, id)
@@ -224,10 +852,12 @@ def update_user(current_user, id):
     user.name = user_data['name']
     user.email = user_data['email']
     user.address = user_data['address']
-    user.password = generate_password_hash(user.password['password'])
+    user.password = hash_password(user_data['password'])
+    old_public_id = user.public_id
     user.public_id=str(uuid.uuid4())
 
     db.session.commit()
+    identity_cache.invalidate(old_public_id)
     return user_schema.jsonify({
             'public_id': user.public_id,
             'name' : user.name,
@@ -243,10 +873,27 @@ def delete_user(current_user, id):
     if not user:
         return jsonify({"message": "Invalid user id"}), 400
     
+    public_id = user.public_id
+    db.session.execute(delete(UserSummary).where(UserSummary.user_id == id))
     db.session.delete(user)
     db.session.commit()
+    identity_cache.invalidate(public_id)
     return jsonify({"message": f"succefully deleted user {id}"}), 200
 
+@app.route('/users/<int:id>/summary', methods=['GET'])
+@token_required
+def get_user_summary(current_user, id):
+    summary = user_summary(id)
+    if not summary:
+        return jsonify({"message": "Invalid user id"}), 400
+
+    return jsonify({'user_id': id, 'order_count': summary.order_count, 'total_spend': summary.total_spend}), 200
+
+# per-worker hit/miss counters for the token_required identity cache
+@app.route('/users/cache_stats', methods=['GET'])
+def get_identity_cache_stats():
+    return jsonify(identity_cache.stats()), 200
+
 #  ======== Product Routes ========
 @app.route('/products', methods=['POST'])
 def create_product():
@@ -257,24 +904,69 @@ def create_product():
     new_product = Product(product_name=product_data['product_name'], price=product_data['price'])
     db.session.add(new_product)
     db.session.commit()
+    invalidate_products(new_product.id)
 
     return product_schema.jsonify(new_product), 201
 
+@app.route('/products/batch', methods=['POST'])
+def create_products():
+    invalid = check_batch(request.json)
+    if invalid:
+        return invalid
+    loaded, errors = {}, {}
+    for i, item in enumerate(request.json):
+        try:
+            loaded[i] = product_schema.load(item)
+        except ValidationError as e:
+            errors[i] = e.messages
+
+    results = [{'index': i, 'status': 400, 'errors': errors[i]} if i in errors else None for i in range(len(request.json))]
+    if errors and is_atomic_batch():
+        return batch_response([r or {'index': i, 'status': 400, 'message': 'Batch not written'} for i, r in enumerate(results)], 0)
+
+    # one flush for the whole batch, SQLAlchemy groups the INSERTs as far as the driver allows
+    new_products = {i: Product(product_name=item.get('product_name'), price=item['price'])
+                    for i, item in loaded.items()}
+    db.session.add_all(new_products.values())
+    db.session.commit()
+    invalidate_products(*[product.id for product in new_products.values()])
+
+    for i, product in new_products.items():
+        results[i] = {'index': i, 'status': 201, 'product': product_schema.dump(product)}
+    return batch_response(results, len(new_products))
+
 @app.route('/products', methods=['GET'])
+@read_replica
 def get_products():
     page = request.args.get('page')
-    query = select(Product).order_by(Product.id)
-    if page:
-        products = db.paginate(query, page=int(page), per_page=20, error_out=False).items
-    else:
-        products = db.session.execute(query).scalars().all()
+    try:
+        query = filter_products(select(Product))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    if not page and not is_cursor_request() and is_stream_request():
+        return stream_ndjson(query, product_schema.dump)
 
-    return products_schema.jsonify(products), 200
+    def load_body():
+        if is_cursor_request():
+            if request.args.get('sort', 'id') != 'id':
+                raise ValueError("Cursor pages are sorted by id, use ?page= with sort")
+            products, meta = keyset_page(query, Product.id)
+            return jsonify({'items': products_schema.dump(products), **meta}).get_data()
+        return products_body(product_rows(page_of(filter_products(select(*PRODUCT_COLUMNS)), page)))
+
+    try:
+        return cached_json(('products', tuple(sorted(request.args.items(multi=True)))), load_body)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
 
 @app.route('/products/<int:id>', methods=['GET'])
+@read_replica
 def get_product(id):
-    product = db.session.get(Product, id)
-    return product_schema.jsonify(product), 200
+    def load_body():
+        rows = product_rows(select(*PRODUCT_COLUMNS).where(Product.id == id))
+        # an unknown id dumps as {} like product_schema.dump(None)
+        return json_body(rows[0], floats=[rows[0]['price']]) if rows else json_body({})
+    return cached_json(('product', id), load_body)
 
 @app.route('/products/<int:id>', methods=['PUT'])
 def update_product(id):
@@ -288,10 +980,13 @@ def update_product(id):
     except ValidationError as e:
         return jsonify(e.messages), 400
     
+    if product_data['price'] != product.price:
+        reprice_spend(id, product_data['price'] - product.price)
     product.product_name = product_data['product_name']
     product.price = product_data['price']
 
     db.session.commit()
+    invalidate_products(id)
     return product_schema.jsonify(product), 200
 
 @app.route('/products/<int:id>', methods=['DELETE'])
@@ -301,8 +996,11 @@ def delete_product(id):
     if not product:
         return jsonify({"message": "Invalid product id"}), 400
     
+    # its order lines go with it
+    reprice_spend(id, -product.price)
     db.session.delete(product)
     db.session.commit()
+    invalidate_products(id)
     return jsonify({"message": f"succefully deleted product {id}"}), 200
 
 #  ======== Order Routes ========
@@ -322,55 +1020,195 @@ def create_order():
         return jsonify({"message": "Invalid user id"}), 400
     new_order = Order(order_date=order_data['order_date'], user_id=user_id)
     db.session.add(new_order)
+    add_orders(user_id, 1)
     db.session.commit()
     
     return order_schema.jsonify(new_order), 201
 
+# one round trip telling whether the order, the product and the order line exist
+# (plus what the user summary needs), answered from primary keys and the unique_product_order index so it does not
+# depend on how many lines the order already has
+def select_order_line(order_id, product_id):
+    return select(
+        exists().where(Order.id == order_id).label('order_exists'),
+        exists().where(Product.id == product_id).label('product_exists'),
+        select(Product.product_name).where(Product.id == product_id).scalar_subquery().label('product_name'),
+        select(Product.price).where(Product.id == product_id).scalar_subquery().label('price'),
+        select(Order.user_id).where(Order.id == order_id).scalar_subquery().label('user_id'),
+        exists().where(order_product.c.order_id == order_id, order_product.c.product_id == product_id).label('line_exists'),
+    )
+
 @app.route('/orders/<int:order_id>/add_product/<int:product_id>', methods=['GET'])
 def add_product(order_id, product_id):
-    order = db.session.get(Order, order_id)
-    if not order:
+    line = db.session.execute(select_order_line(order_id, product_id)).one()
+    if not line.order_exists:
         return jsonify({"message": "Invalid order id"}), 400
-    product = db.session.get(Product, product_id)
-    if not product:
+    if not line.product_exists:
         return jsonify({"message": "Invalid product id"}), 400
+    if line.line_exists:
+        return jsonify({"message": f"Duplicate proudct {line.product_name} for order {order_id}"}), 400
     try:
-        product_name = product.product_name
-        order.products.append(product)
+        db.session.execute(order_product.insert().values(order_id=order_id, product_id=product_id))
+        add_spend(line.user_id, line.price)
         db.session.commit()
     except exc.IntegrityError as e:
-        return jsonify({"message": f"Duplicate proudct {product_name} for order {order_id}"}), 400
+        # another request added the same line after our check
+        db.session.rollback()
+        return jsonify({"message": f"Duplicate proudct {line.product_name} for order {order_id}"}), 400
     
-    return jsonify({"message": f"{product.product_name} added to order {order_id}!"}), 200
+    return jsonify({"message": f"{line.product_name} added to order {order_id}!"}), 200
 
 @app.route('/orders/<int:order_id>/remove_product/<int:product_id>', methods=['DELETE'])
 def remove_product(order_id, product_id):
-    order = db.session.get(Order, order_id)
-    if not order:
+    line = db.session.execute(select_order_line(order_id, product_id)).one()
+    if not line.order_exists:
         return jsonify({"message": "Invalid order id"}), 400
-    product = db.session.get(Product, product_id)
-    if not product:
+    if not line.product_exists:
         return jsonify({"message": "Invalid product id"}), 400
+    if not line.line_exists:
+        return jsonify({"message": f"{line.product_name} is not in order {order_id}"}), 400
 
-    order.products.remove(product)
+    db.session.execute(order_product.delete().where(order_product.c.order_id == order_id, order_product.c.product_id == product_id))
+    add_spend(line.user_id, -line.price)
     db.session.commit()
     
-    return jsonify({"message": f"{product.product_name} removed from order {order_id}!"}), 200
+    return jsonify({"message": f"{line.product_name} removed from order {order_id}!"}), 200
+
+# body is an array of product ids to add to the order
+@app.route('/orders/<int:order_id>/products', methods=['POST'])
+def add_products(order_id):
+    invalid = check_batch(request.json)
+    if invalid:
+        return invalid
+    user_id = db.session.execute(select(Order.user_id).where(Order.id == order_id)).scalar()
+    if user_id is None:
+        return jsonify({"message": "Invalid order id"}), 400
+
+    product_ids = [product_id for product_id in request.json if type(product_id) is int]
+    names = {}
+    prices = {}
+    for product_id, product_name, price in db.session.execute(select(Product.id, Product.product_name, Product.price).where(Product.id.in_(product_ids))):
+        names[product_id] = product_name
+        prices[product_id] = price
+    existing = set(db.session.execute(select(order_product.c.product_id).where(
+        order_product.c.order_id == order_id, order_product.c.product_id.in_(product_ids))).scalars())
+
+    results = []
+    rows = []
+    for product_id in request.json:
+        # not isinstance, JSON true and false are ints to it
+        if type(product_id) is not int:
+            results.append({'product_id': product_id, 'status': 400, 'message': "Product id must be an integer"})
+        elif product_id not in names:
+            results.append({'product_id': product_id, 'status': 400, 'message': "Invalid product id"})
+        elif product_id in existing:
+            results.append({'product_id': product_id, 'status': 400, 'message': f"Duplicate proudct {names[product_id]} for order {order_id}"})
+        else:
+            existing.add(product_id)
+            rows.append({'order_id': order_id, 'product_id': product_id})
+            results.append({'product_id': product_id, 'status': 201, 'message': f"{names[product_id]} added to order {order_id}!"})
+
+    if len(rows) < len(results) and is_atomic_batch():
+        for result in results:
+            if result['status'] == 201:
+                result.update(status=400, message="Batch not written")
+        return batch_response(results, 0)
+
+    if rows:
+        try:
+            # a single executemany against order_product
+            db.session.execute(order_product.insert(), rows)
+            add_spend(user_id, sum(prices[row['product_id']] for row in rows))
+            db.session.commit()
+        except exc.IntegrityError as e:
+            # another request added one of these lines after our check
+            db.session.rollback()
+            return jsonify({"message": f"Duplicate product for order {order_id}"}), 400
+    return batch_response(results, len(rows))
+
+# product count and total for one order in a single aggregate query, no row when the order does not exist
+def select_order_summary(order_id):
+    return (select(Order.id, func.count(Product.id), func.coalesce(func.sum(Product.price), 0))
+            .outerjoin(order_product, Order.id == order_product.c.order_id)
+            .outerjoin(Product, Product.id == order_product.c.product_id)
+            .where(Order.id == order_id).group_by(Order.id))
+
+@app.route('/orders/<int:order_id>/summary', methods=['GET'])
+@read_replica
+def get_order_summary(order_id):
+    summary = db.session.execute(select_order_summary(order_id)).first()
+    if not summary:
+        return jsonify({"message": "Invalid order id"}), 400
+
+    return jsonify({'order_id': order_id, 'product_count': summary[1], 'total': float(summary[2])}), 200
+
+# ?expand=products,user nests those relationships in each order, each one is loaded
+# with a single extra SELECT ... IN query however many orders there are
+ORDER_EXPANSIONS = {'products': Order.products, 'user': Order.user}
+
+def order_expansions():
+    expand = [name for name in request.args.get('expand', '').split(',') if name]
+    unknown = [name for name in expand if name not in ORDER_EXPANSIONS]
+    if unknown:
+        raise ValueError(f"Cannot expand {', '.join(unknown)}")
+    return expand
+
+def select_orders_for_user(user_id, expand=()):
+    query = select(Order).where(Order.user_id == user_id).order_by(Order.id)
+    for name in expand:
+        query = query.options(selectinload(ORDER_EXPANSIONS[name]))
+    return query
+
+def dump_orders(orders, expand=()):
+    output = orders_schema.dump(orders)
+    for order, order_data in zip(orders, output):
+        if 'products' in expand:
+            order_data['products'] = products_schema.dump(order.products)
+        if 'user' in expand:
+            order_data['user'] = user_schema.dump({
+                'public_id': order.user.public_id,
+                'name' : order.user.name,
+                'email' : order.user.email,
+                'address' : order.user.address
+            })
+    return output
 
 @app.route('/orders/user/<int:user_id>', methods=['GET'])
+@read_replica
 def get_orders_for_user(user_id):
-    query = select(Order).where(Order.user_id == user_id)
-    orders = db.session.execute(query).scalars().all()
+    try:
+        expand = order_expansions()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    if not expand:
+        orders = order_rows(select(*ORDER_COLUMNS).where(Order.user_id == user_id).order_by(Order.id))
+        return json_response(json_body(orders)), 200
+    orders = db.session.execute(select_orders_for_user(user_id, expand)).scalars().all()
 
-    return orders_schema.jsonify(orders), 200
+    return jsonify(dump_orders(orders, expand)), 200
 
 @app.route('/orders/<int:order_id>/products', methods=['GET'])
+@read_replica
 def get_products_for_order(order_id):
-    order = db.session.get(Order, order_id)
-    if not order:
+    if not db.session.execute(select(exists().where(Order.id == order_id))).scalar():
         return jsonify({"message": "Invalid order id"}), 400
     
-    return products_schema.jsonify(order.products), 200
+    # same shape as the order.products lazy load, without building the Product objects
+    query = select(*PRODUCT_COLUMNS).where(order_product.c.order_id == order_id, Product.id == order_product.c.product_id)
+    return json_response(products_body(product_rows(query))), 200
+
+#  ======== Metrics Routes ========
+# Prometheus text exposition of this worker's request, sql, serialization and auth timings
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    stats = identity_cache.stats()
+    body = metrics.render() + (
+        '# TYPE identity_cache_hits_total counter\n'
+        f'identity_cache_hits_total {stats["hits"]}\n'
+        '# TYPE identity_cache_misses_total counter\n'
+        f'identity_cache_misses_total {stats["misses"]}\n'
+    )
+    return Response(body, mimetype='text/plain; version=0.0.4')
 
 if __name__ == "__main__":
     with app.app_context():
@@ -0,0 +1,226 @@
+#asgi_app.py
+# Async entry point serving the same API on an ASGI server:
+#
+#   uvicorn asgi_app:app
+#
+# The read routes that spend their time waiting on the database run natively on
+# SQLAlchemy's asyncio engine (app.config['ASYNC_DATABASE_URI']), so one process
+# can keep thousands of them in flight. Every other route, and any option these
+# handlers do not cover (cursor pages, streaming, ?expand, ...), is handed to the
+# Flask app in app.py on a worker thread, so responses are the same either way.
+import hashlib
+import time
+import urllib.parse
+from contextvars import ContextVar
+
+import jwt
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import event, exists, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_cookie
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+
+from app import (app as flask_app, User, Order, Product, UserSummary, order_product,
+                 USER_COLUMNS, PRODUCT_COLUMNS, ORDER_COLUMNS, user_dicts, product_dicts, order_dicts,
+                 filter_products, page_of, select_order_summary, json_body, reads_primary,
+                 identity_cache, detached_user, product_cache, metrics)
+
+engine = create_async_engine(flask_app.config['ASYNC_DATABASE_URI'], **flask_app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+Session = async_sessionmaker(engine, expire_on_commit=False)
+wsgi_app = WsgiToAsgi(flask_app)
+
+# sql timings for /metrics, per request like g.timings in the Flask app
+request_timings = ContextVar('request_timings', default=None)
+
+@event.listens_for(engine.sync_engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(engine.sync_engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    timings = request_timings.get()
+    if timings is not None:
+        timings['sql_statements'] += 1
+        timings['sql_seconds'] += elapsed
+
+@event.listens_for(engine.sync_engine, 'handle_error')
+def handle_error(context):
+    if context.execution_context is not None and context.connection.info.get('query_start'):
+        context.connection.info['query_start'].pop()
+
+class Request:
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = MultiDict(urllib.parse.parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True))
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        self.cookies = parse_cookie(self.headers.get('cookie', ''))
+
+# (status, body, extra headers) the way jsonify would have written data
+def reply(data, status=200, floats=(), headers=()):
+    with flask_app.app_context():
+        return status, json_body(data, floats), list(headers)
+
+def products_reply(rows, status=200):
+    return reply(rows, status, floats=[row['price'] for row in rows])
+
+# async counterpart of token_required, returns the 401 reply or None when the token is good
+async def check_token(request, session):
+    token = request.headers.get('x-access-token')
+    if not token:
+        return reply({'message' : 'Token is missing !!'}, 401)
+    try:
+        data = jwt.decode(token, flask_app.config['SECRET_KEY'], algorithms=['HS256'])
+        if identity_cache.get(token) is None:
+            user = (await session.execute(select(User).where(User.public_id == data['public_id']))).scalars().first()
+            if user is not None:
+                identity_cache.put(token, data.get('exp'), detached_user(user))
+    except:
+        return reply({'message' : 'Token is invalid !!'}, 401)
+    return None
+
+# same product_cache and ETags as the Flask routes, so writes made there invalidate these;
+# like cached_json, clients that wrote recently skip entries filled from the replica
+async def cached_reply(request, key, load):
+    entry = None if reads_primary(request.cookies) else product_cache.get(key)
+    if entry is None:
+        status, body, headers = await load()
+        if status != 200:
+            return status, body, headers
+        entry = (hashlib.sha256(body).hexdigest(), body)
+        product_cache.put(key, *entry)
+    etag, body = entry
+    headers = [('etag', f'"{etag}"')]
+    if f'"{etag}"' in request.headers.get('if-none-match', ''):
+        return 304, b'', headers
+    return 200, body, headers
+
+#======== Async Routes ========
+# each handler returns (status, body, headers), or None to let the Flask app answer
+
+async def get_users(request, session):
+    if 'after' in request.args or 'limit' in request.args or request.args.get('stream') or 'ndjson' in request.headers.get('accept', ''):
+        return None
+    denied = await check_token(request, session)
+    if denied:
+        return denied
+    try:
+        query = page_of(select(*USER_COLUMNS).order_by(User.id), request.args.get('page'))
+    except ValueError as e:
+        return reply({"message": str(e)}, 400)
+    return reply(user_dicts(await session.execute(query)))
+
+async def get_user(request, session, id):
+    denied = await check_token(request, session)
+    if denied:
+        return denied
+    rows = (await session.execute(select(*USER_COLUMNS).where(User.id == id))).all()
+    if not rows:
+        # let the Flask route answer exactly as it does for an unknown id
+        return None
+    return reply(user_dicts(rows)[0])
+
+async def get_user_summary(request, session, id):
+    denied = await check_token(request, session)
+    if denied:
+        return denied
+    summary = await session.get(UserSummary, id)
+    if summary is None:
+        # the Flask route builds missing summaries from the user's history
+        return None
+    return reply({'user_id': id, 'order_count': summary.order_count, 'total_spend': summary.total_spend})
+
+async def get_products(request, session):
+    if 'after' in request.args or 'limit' in request.args or request.args.get('stream') or 'ndjson' in request.headers.get('accept', ''):
+        return None
+
+    async def load():
+        try:
+            query = page_of(filter_products(select(*PRODUCT_COLUMNS), request.args), request.args.get('page'))
+        except ValueError as e:
+            return reply({"message": str(e)}, 400)
+        return products_reply(product_dicts(await session.execute(query)))
+
+    return await cached_reply(request, ('products', tuple(sorted(request.args.items(multi=True)))), load)
+
+async def get_product(request, session, id):
+    async def load():
+        rows = product_dicts(await session.execute(select(*PRODUCT_COLUMNS).where(Product.id == id)))
+        return reply(rows[0], floats=[rows[0]['price']]) if rows else reply({})
+
+    return await cached_reply(request, ('product', id), load)
+
+async def get_orders_for_user(request, session, user_id):
+    if request.args.get('expand'):
+        return None
+    query = select(*ORDER_COLUMNS).where(Order.user_id == user_id).order_by(Order.id)
+    return reply(order_dicts(await session.execute(query)))
+
+async def get_products_for_order(request, session, order_id):
+    if not (await session.execute(select(exists().where(Order.id == order_id)))).scalar():
+        return reply({"message": "Invalid order id"}, 400)
+    query = select(*PRODUCT_COLUMNS).where(order_product.c.order_id == order_id, Product.id == order_product.c.product_id)
+    return products_reply(product_dicts(await session.execute(query)))
+
+async def get_order_summary(request, session, order_id):
+    summary = (await session.execute(select_order_summary(order_id))).first()
+    if not summary:
+        return reply({"message": "Invalid order id"}, 400)
+    return reply({'order_id': order_id, 'product_count': summary[1], 'total': float(summary[2])})
+
+# same rules as the Flask routes, so /metrics labels line up
+routes = Map([
+    Rule('/users', endpoint=get_users, methods=['GET']),
+    Rule('/users/<int:id>', endpoint=get_user, methods=['GET']),
+    Rule('/users/<int:id>/summary', endpoint=get_user_summary, methods=['GET']),
+    Rule('/products', endpoint=get_products, methods=['GET']),
+    Rule('/products/<int:id>', endpoint=get_product, methods=['GET']),
+    Rule('/orders/user/<int:user_id>', endpoint=get_orders_for_user, methods=['GET']),
+    Rule('/orders/<int:order_id>/products', endpoint=get_products_for_order, methods=['GET']),
+    Rule('/orders/<int:order_id>/summary', endpoint=get_order_summary, methods=['GET']),
+])
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return await wsgi_app(scope, receive, send)
+
+    try:
+        rule, kwargs = routes.bind('', path_info=scope['path']).match(method=scope['method'], return_rule=True)
+    except HTTPException:
+        return await wsgi_app(scope, receive, send)
+
+    start = time.perf_counter()
+    timings = request_timings.set({'sql_statements': 0, 'sql_seconds': 0.0})
+    try:
+        async with Session() as session:
+            response = await rule.endpoint(Request(scope), session, **kwargs)
+    finally:
+        recorded = request_timings.get()
+        request_timings.reset(timings)
+    if response is None:
+        return await wsgi_app(scope, receive, send)
+    metrics.observe(rule.rule, scope['method'], time.perf_counter() - start, recorded)
+
+    status, body, headers = response
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', flask_app.json.mimetype.encode()), (b'content-length', str(len(body)).encode())]
+                   + [(name.encode(), value.encode()) for name, value in headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,232 @@
+#benchmarks/bench_async.py
+# Serves the same seeded SQLite database from the sync app on a fixed pool of
+# worker threads and from asgi_app on uvicorn, checks both give the same
+# responses, then drives the database bound read routes through each one with
+# simulated query latency and reports throughput plus p50/p95/p99 as JSON.
+#
+#   python benchmarks/bench_async.py --db-latency-ms 50 --concurrency 64 --sync-threads 16
+import argparse
+import json
+import logging
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def scenarios(args):
+    half = args.users // 2
+    return [
+        ('GET /users/<id>', lambda i: f'/users/{1 + i % half}'),
+        ('GET /users/<id>/summary', lambda i: f'/users/{1 + i % half}/summary'),
+        ('GET /products?q', lambda i: f'/products?q=product {i % 100}'),
+        ('GET /orders/user/<id>', lambda i: f'/orders/user/{1 + i % half}'),
+        ('GET /orders/<id>/products', lambda i: f'/orders/{1 + i % args.orders}/products'),
+        ('GET /orders/<id>/summary', lambda i: f'/orders/{1 + i % args.orders}/summary'),
+    ]
+
+
+def seed(args):
+    from sqlalchemy import insert
+    from app import app, db, User, Order, Product, order_product, user_summary
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(insert(User), [{'name': f'user {i}', 'address': f'{i} bench street', 'email': f'user{i}@example.com',
+                                           'password': 'x', 'public_id': f'user-{i}'} for i in range(args.users)])
+        db.session.execute(insert(Product), [{'product_name': f'product {i}', 'price': 1.0 + i % 100} for i in range(args.products)])
+        db.session.execute(insert(Order), [{'user_id': 1 + i % args.users} for i in range(args.orders)])
+        db.session.execute(insert(order_product), [{'order_id': o, 'product_id': 1 + (o + l) % args.products}
+                                                   for o in range(1, args.orders + 1) for l in range(args.lines)])
+        db.session.commit()
+        # build every summary row up front, the sync route would otherwise write them on first read
+        for user_id in range(1, args.users + 1):
+            user_summary(user_id)
+        db.session.commit()
+
+
+# every statement waits ms on the database side first, standing in for a network
+# round trip; under aiosqlite the wait happens on the connection's own thread
+def add_db_latency(engine, ms):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.create_function('bench_sleep', 1, lambda ms: time.sleep(ms / 1000))
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        cursor.execute('SELECT bench_sleep(?)', (ms,))
+
+
+def serve(args):
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    if args.serve == 'async':
+        import uvicorn
+        import asgi_app
+        add_db_latency(asgi_app.engine.sync_engine, args.db_latency_ms)
+        uvicorn.run(asgi_app.app, host='127.0.0.1', port=args.port, log_level='warning')
+    else:
+        import socketserver
+        from werkzeug.serving import BaseWSGIServer
+        from app import app, db
+
+        # a fixed number of request threads, like a sync worker's thread pool
+        class PooledWSGIServer(socketserver.ThreadingMixIn, BaseWSGIServer):
+            pool = ThreadPoolExecutor(args.sync_threads)
+
+            def process_request(self, request, client_address):
+                self.pool.submit(self.process_request_thread, request, client_address)
+
+        with app.app_context():
+            add_db_latency(db.engine, args.db_latency_ms)
+        PooledWSGIServer('127.0.0.1', args.port, app).serve_forever()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(kind, args):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', kind, '--port', str(port),
+                                '--db-latency-ms', str(args.db_latency_ms), '--sync-threads', str(args.sync_threads)])
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                sys.exit(f'{kind} server did not start')
+            time.sleep(0.1)
+
+
+def fetch(base, path, headers):
+    start = time.perf_counter()
+    request = urllib.request.Request(base + urllib.parse.quote(path, safe='/?=&'), headers=headers)
+    try:
+        with urllib.request.urlopen(request) as response:
+            return time.perf_counter() - start, response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return time.perf_counter() - start, e.code, e.read()
+
+
+def percentile(latencies, p):
+    # nearest rank
+    ordered = sorted(latencies)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(latencies, elapsed, statuses):
+    return {
+        'requests': len(latencies),
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'statuses': {str(status): statuses.count(status) for status in sorted(set(statuses))},
+    }
+
+
+def load(base, args, headers):
+    results = {}
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        for name, url in scenarios(args):
+            started = time.perf_counter()
+            timings = list(pool.map(lambda path: fetch(base, path, headers), [url(i) for i in range(args.requests)]))
+            results[name] = summarize([t for t, _, _ in timings], time.perf_counter() - started, [s for _, s, _ in timings])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--lines', type=int, default=5, help='products per seeded order')
+    parser.add_argument('--requests', type=int, default=400, help='HTTP calls per route')
+    parser.add_argument('--concurrency', type=int, default=64, help='HTTP load generator threads')
+    parser.add_argument('--sync-threads', type=int, default=16, help='request threads of the sync server')
+    parser.add_argument('--db-latency-ms', type=float, default=50, help='simulated wait per SQL statement')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--serve', choices=['sync', 'async'], help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args)
+
+    bench_dir = tempfile.mkdtemp(prefix='restapi-bench-')
+    database = os.path.join(bench_dir, 'bench.db')
+    # both servers are child processes and read these through app.config.from_prefixed_env()
+    os.environ.setdefault('FLASK_SQLALCHEMY_DATABASE_URI', f'sqlite:///{database}')
+    os.environ.setdefault('FLASK_ASYNC_DATABASE_URI', f'sqlite+aiosqlite:///{database}')
+    # one connection per in flight request on either server
+    os.environ.setdefault('FLASK_DB_POOL_SIZE', str(args.concurrency))
+    os.environ.setdefault('FLASK_DB_MAX_OVERFLOW', '0')
+    os.environ.setdefault('FLASK_SLOW_REQUEST_QUERIES', '1e309')
+    os.environ.setdefault('FLASK_SLOW_REQUEST_SECONDS', '1e309')
+
+    servers = []
+    try:
+        seed(args)
+        import jwt
+        from app import app
+        token = jwt.encode({'public_id': 'user-0', 'exp': datetime.now(timezone.utc) + timedelta(minutes=30)}, app.config['SECRET_KEY'])
+        headers = {'x-access-token': token}
+
+        servers = [start_server('sync', args), start_server('async', args)]
+        (_, sync_base), (_, async_base) = servers
+
+        # same status and body from both servers before timing anything
+        mismatched = []
+        for name, url in scenarios(args):
+            for i in range(3):
+                _, sync_status, sync_body = fetch(sync_base, url(i), headers)
+                _, async_status, async_body = fetch(async_base, url(i), headers)
+                if (sync_status, sync_body) != (async_status, async_body):
+                    mismatched.append(f'{url(i)}: {sync_status} {sync_body[:80]!r} != {async_status} {async_body[:80]!r}')
+
+        report = {
+            'seed': {'users': args.users, 'products': args.products, 'orders': args.orders, 'lines': args.lines},
+            'db_latency_ms': args.db_latency_ms,
+            'concurrency': args.concurrency,
+            'sync_threads': args.sync_threads,
+            'sync': load(sync_base, args, headers),
+            'async': load(async_base, args, headers),
+        }
+    finally:
+        for process, _ in servers:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(bench_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    for line in mismatched:
+        print(f'differs {line}', file=sys.stderr)
+    if mismatched:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
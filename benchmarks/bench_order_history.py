@@ -0,0 +1,88 @@
+#benchmarks/bench_order_history.py
+# Counts the SQL statements needed for a user's order history with nested
+# products: GET /orders/user/<user_id> followed by one /orders/<order_id>/products
+# call per order (N+1) against GET /orders/user/<user_id>?expand=products,user.
+# Both go through the Flask test client. Exits non-zero if the expanded history
+# stops being a fixed number of queries.
+#
+#   python benchmarks/bench_order_history.py --orders 200 --lines 10
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = tempfile.TemporaryDirectory(prefix='restapi-bench-')
+# must be set before app is imported, the engine is built at import time
+os.environ.setdefault('FLASK_SQLALCHEMY_DATABASE_URI', f"sqlite:///{os.path.join(BENCH_DIR.name, 'bench.db')}")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import event, insert
+from app import app, db, User, Order, Product, order_product
+
+# one SELECT for the orders plus one per expanded relationship
+EXPANDED_QUERIES = 3
+
+
+def seed(orders, lines):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(User(name='bench', address='bench', email='bench@example.com', password='x', public_id='bench'))
+        db.session.flush()
+        db.session.execute(insert(Product), [{'product_name': f'product {i}', 'price': 1.0} for i in range(lines)])
+        db.session.execute(insert(Order), [{'user_id': 1} for _ in range(orders)])
+        db.session.execute(insert(order_product), [{'order_id': o, 'product_id': p}
+                                                   for o in range(1, orders + 1) for p in range(1, lines + 1)])
+        db.session.commit()
+
+
+# what a client had to do before: list the orders, then fetch each order's products
+def lazy_history(client):
+    output = client.get('/orders/user/1').json
+    for order in output:
+        order['products'] = client.get(f"/orders/{order['id']}/products").json
+    return output
+
+
+def expanded_history(client):
+    return client.get('/orders/user/1?expand=products,user').json
+
+
+def measure(fn, client):
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', listener)
+    start = time.perf_counter()
+    output = fn(client)
+    elapsed = (time.perf_counter() - start) * 1000
+    event.remove(engine, 'before_cursor_execute', listener)
+    return output, len(statements), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=200)
+    parser.add_argument('--lines', type=int, default=10)
+    args = parser.parse_args()
+
+    seed(args.orders, args.lines)
+    client = app.test_client()
+    _, lazy_queries, lazy_ms = measure(lazy_history, client)
+    output, expanded_queries, expanded_ms = measure(expanded_history, client)
+    BENCH_DIR.cleanup()
+
+    print(f"user with {args.orders} orders of {args.lines} products each")
+    print(f"  {'one call per order:':24}{lazy_queries:6d} queries {lazy_ms:8.2f} ms")
+    print(f"  {'?expand=products,user:':24}{expanded_queries:6d} queries {expanded_ms:8.2f} ms")
+
+    if len(output) != args.orders or any(len(order['products']) != args.lines for order in output):
+        sys.exit("expanded order history is missing orders or products")
+    if expanded_queries > EXPANDED_QUERIES:
+        sys.exit(f"expanded order history ran {expanded_queries} queries, expected at most {EXPANDED_QUERIES}")
+
+
+if __name__ == '__main__':
+    main()
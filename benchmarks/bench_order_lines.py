@@ -0,0 +1,89 @@
+#benchmarks/bench_order_lines.py
+# Compares adding and removing one line on a large order through the ORM
+# collection (order.products.append/remove) against the direct order_product
+# INSERT/DELETE used by the add_product and remove_product routes.
+#
+#   python benchmarks/bench_order_lines.py --lines 10000 --iterations 50
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+# the app's own engine is not used here, keep it off the production database
+os.environ.setdefault('FLASK_SQLALCHEMY_DATABASE_URI', 'sqlite://')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import Base, User, Order, Product, order_product, select_order_line
+
+
+def seed(engine, lines):
+    with Session(engine) as session:
+        session.add(User(name='bench', address='bench', email='bench@example.com', password='x', public_id='bench'))
+        session.flush()
+        session.add(Order(user_id=1))
+        # one spare product that is added and removed by the benchmark
+        session.execute(insert(Product), [{'product_name': f'product {i}', 'price': 1.0} for i in range(lines + 1)])
+        session.execute(insert(order_product), [{'order_id': 1, 'product_id': i} for i in range(1, lines + 1)])
+        session.commit()
+    return lines + 1
+
+
+# what the routes did before: load order and product, then mutate the collection
+def orm_collection(engine, product_id):
+    with Session(engine) as session:
+        order = session.get(Order, 1)
+        product = session.get(Product, product_id)
+        order.products.append(product)
+        session.commit()
+    with Session(engine) as session:
+        order = session.get(Order, 1)
+        product = session.get(Product, product_id)
+        order.products.remove(product)
+        session.commit()
+
+
+# what the routes do now: one existence query, then a single INSERT/DELETE
+def direct_statements(engine, product_id):
+    with Session(engine) as session:
+        session.execute(select_order_line(1, product_id)).one()
+        session.execute(order_product.insert().values(order_id=1, product_id=product_id))
+        session.commit()
+    with Session(engine) as session:
+        session.execute(select_order_line(1, product_id)).one()
+        session.execute(order_product.delete().where(order_product.c.order_id == 1, order_product.c.product_id == product_id))
+        session.commit()
+
+
+def timed(fn, engine, product_id, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(engine, product_id)
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=10000)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        product_id = seed(engine, args.lines)
+
+        orm_ms = timed(orm_collection, engine, product_id, args.iterations)
+        direct_ms = timed(direct_statements, engine, product_id, args.iterations)
+        engine.dispose()
+
+    print(f"order with {args.lines} lines, add + remove one line, mean of {args.iterations} runs")
+    print(f"  orm collection:    {orm_ms:8.2f} ms")
+    print(f"  direct statements: {direct_ms:8.2f} ms")
+    print(f"  speedup:           {orm_ms / direct_ms:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+#benchmarks/bench_routes.py
+# Seeds a SQLite database, drives every route through the Flask test client
+# and then the read routes through a multi-threaded HTTP load generator, and
+# reports throughput plus p50/p95/p99 latency per route as JSON.
+#
+#   python benchmarks/bench_routes.py --users 1000 --products 5000 --orders 2000 --lines 5 --output run.json
+#   python benchmarks/bench_routes.py --baseline run.json   # exits 1 when a route's p95 regressed
+import argparse
+import json
+import logging
+import math
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = tempfile.mkdtemp(prefix='restapi-bench-')
+# must be set before app is imported, the engine is built at import time
+os.environ.setdefault('FLASK_SQLALCHEMY_DATABASE_URI', f"sqlite:///{os.path.join(BENCH_DIR, 'bench.db')}")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import make_server
+from app import app, db, User, Order, Product, order_product, hash_password
+
+BENCH_EMAIL = 'bench@example.com'
+BENCH_PASSWORD = 'bench'
+
+
+def seed(args):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(insert(User), [{
+            'name': f'user {i}', 'address': f'{i} bench street', 'email': f'user{i}@example.com',
+            'password': 'x', 'public_id': f'user-{i}',
+        } for i in range(args.users)])
+        # user 1 is the one the benchmark logs in as
+        db.session.get(User, 1).email = BENCH_EMAIL
+        db.session.get(User, 1).password = generate_password_hash(BENCH_PASSWORD, app.config['PASSWORD_HASH_METHOD'])
+        db.session.execute(insert(Product), [{'product_name': f'product {i}', 'price': 1.0 + i % 100} for i in range(args.products)])
+        db.session.execute(insert(Order), [{'user_id': 1 + i % args.users} for i in range(args.orders)])
+        db.session.execute(insert(order_product), [{'order_id': o, 'product_id': 1 + (o + l) % args.lines}
+                                                   for o in range(1, args.orders + 1) for l in range(args.lines)])
+        db.session.commit()
+        # start the hashing processes so the first login is not charged for them
+        hash_password('warm up')
+
+
+# (name, method, url(i), json body(i)) for every route; i is the iteration number.
+# Writes use id ranges that do not overlap so every call takes its success path.
+def scenarios(args):
+    half = args.users // 2
+    spare = args.products - args.lines
+    return [
+        ('POST /login', 'POST', lambda i: '/login', lambda i: {'email': BENCH_EMAIL, 'password': BENCH_PASSWORD}),
+        ('POST /users', 'POST', lambda i: '/users', lambda i: {'name': 'new', 'address': 'new', 'email': f'new{i}@example.com', 'password': 'pw'}),
+        ('GET /users', 'GET', lambda i: '/users', None),
+        ('GET /users?page', 'GET', lambda i: f'/users?page={1 + i % 10}', None),
+        ('GET /users?limit', 'GET', lambda i: '/users?limit=20', None),
+        ('GET /users/<id>', 'GET', lambda i: f'/users/{2 + i % half}', None),
+        ('PUT /users/<id>', 'PUT', lambda i: f'/users/{2 + i % half}', lambda i: {'name': 'upd', 'address': 'upd', 'email': f'upd{i}@example.com', 'password': 'pw'}),
+        ('DELETE /users/<id>', 'DELETE', lambda i: f'/users/{args.users - i}', None),
+        ('GET /users/<id>/summary', 'GET', lambda i: f'/users/{1 + i % half}/summary', None),
+        ('GET /users/cache_stats', 'GET', lambda i: '/users/cache_stats', None),
+        ('POST /products', 'POST', lambda i: '/products', lambda i: {'product_name': f'new {i}', 'price': 9.99}),
+        ('POST /products/batch', 'POST', lambda i: '/products/batch', lambda i: [{'product_name': f'batch {i} {j}', 'price': 1.5} for j in range(20)]),
+        ('GET /products', 'GET', lambda i: '/products', None),
+        ('GET /products?page', 'GET', lambda i: f'/products?page={1 + i % 10}', None),
+        ('GET /products?limit', 'GET', lambda i: '/products?limit=20', None),
+        ('GET /products?q', 'GET', lambda i: f'/products?q=product {i % 100}', None),
+        ('GET /products?min_price&max_price&sort', 'GET', lambda i: f'/products?min_price={i % 90}&max_price={i % 90 + 1}&sort=price', None),
+        ('GET /products?stream', 'GET', lambda i: '/products?stream=1', None),
+        ('GET /products/<id>', 'GET', lambda i: f'/products/{1 + i % args.products}', None),
+        ('PUT /products/<id>', 'PUT', lambda i: f'/products/{1 + i % args.products}', lambda i: {'product_name': f'upd {i}', 'price': 2.5}),
+        ('POST /orders', 'POST', lambda i: '/orders', lambda i: {'user_id': 1, 'order_date': '2021-09-09 15:44:15.81785'}),
+        ('GET /orders/<id>/add_product/<id>', 'GET', lambda i: f'/orders/1/add_product/{args.lines + 1 + i % spare}', None),
+        ('DELETE /orders/<id>/remove_product/<id>', 'DELETE', lambda i: f'/orders/1/remove_product/{args.lines + 1 + i % spare}', None),
+        ('POST /orders/<id>/products', 'POST', lambda i: f'/orders/{2 + i}/products', lambda i: list(range(args.lines + 1, args.lines + 21))),
+        ('GET /orders/user/<id>', 'GET', lambda i: f'/orders/user/{1 + i % half}', None),
+        ('GET /orders/user/<id>?expand', 'GET', lambda i: f'/orders/user/{1 + i % half}?expand=products,user', None),
+        ('GET /orders/<id>/products', 'GET', lambda i: f'/orders/{1 + i % args.orders}/products', None),
+        ('GET /orders/<id>/summary', 'GET', lambda i: f'/orders/{1 + i % args.orders}/summary', None),
+        ('DELETE /products/<id>', 'DELETE', lambda i: f'/products/{args.products - i}', None),
+        ('GET /metrics', 'GET', lambda i: '/metrics', None),
+    ]
+
+
+def percentile(latencies, p):
+    # nearest rank
+    ordered = sorted(latencies)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(latencies, elapsed, statuses):
+    return {
+        'requests': len(latencies),
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'statuses': {str(status): statuses.count(status) for status in sorted(set(statuses))},
+    }
+
+
+def login(client):
+    return client.post('/login', json={'email': BENCH_EMAIL, 'password': BENCH_PASSWORD}).json['token']
+
+
+def run_test_client(args):
+    client = app.test_client()
+    headers = {'x-access-token': login(client)}
+    results = {}
+    for name, method, url, body in scenarios(args):
+        latencies, statuses = [], []
+        started = time.perf_counter()
+        for i in range(args.iterations):
+            start = time.perf_counter()
+            response = client.open(url(i), method=method, json=body(i) if body else None, headers=headers)
+            response.get_data()
+            latencies.append(time.perf_counter() - start)
+            statuses.append(response.status_code)
+        results[name] = summarize(latencies, time.perf_counter() - started, statuses)
+    return results
+
+
+def run_http(args):
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    headers = {'x-access-token': login(app.test_client())}
+
+    def fetch(path):
+        start = time.perf_counter()
+        request = urllib.request.Request(base + urllib.parse.quote(path, safe='/?=&'), headers=headers)
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        return time.perf_counter() - start, status
+
+    results = {}
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        for name, method, url, body in scenarios(args):
+            if method != 'GET' or '/add_product/' in name:
+                continue
+            started = time.perf_counter()
+            timings = list(pool.map(fetch, [url(i) for i in range(args.http_requests)]))
+            results[name] = summarize([t for t, _ in timings], time.perf_counter() - started, [s for _, s in timings])
+    server.shutdown()
+    return results
+
+
+# routes whose p95 grew by more than tolerance against a previous run
+def regressions(report, baseline, tolerance):
+    found = []
+    for section in ('test_client', 'http'):
+        for name, stats in report.get(section, {}).items():
+            before = baseline.get(section, {}).get(name)
+            if before and stats['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                found.append(f"{section} {name}: p95 {before['p95_ms']}ms -> {stats['p95_ms']}ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--lines', type=int, default=5, help='products per seeded order')
+    parser.add_argument('--iterations', type=int, default=50, help='test client calls per route')
+    parser.add_argument('--http-requests', type=int, default=200, help='HTTP calls per read route')
+    parser.add_argument('--concurrency', type=int, default=8, help='HTTP load generator threads')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='earlier JSON report to compare p95 latencies against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 growth before a route counts as regressed')
+    args = parser.parse_args()
+    if args.iterations > min(args.users // 2, args.orders - 2, args.products - args.lines):
+        parser.error('--iterations must leave enough seeded users, orders and products for the write routes')
+
+    # keep the slow request log quiet, every route is timed here anyway
+    app.config['SLOW_REQUEST_QUERIES'] = float('inf')
+    app.config['SLOW_REQUEST_SECONDS'] = float('inf')
+
+    try:
+        seed(args)
+        report = {
+            'database': app.config['SQLALCHEMY_DATABASE_URI'],
+            'seed': {'users': args.users, 'products': args.products, 'orders': args.orders, 'lines': args.lines},
+            'test_client': run_test_client(args),
+            'http': run_http(args),
+        }
+    finally:
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f), args.tolerance)
+        for line in found:
+            print(f"regressed {line}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#benchmarks/check_query_plans.py
+# Runs EXPLAIN QUERY PLAN on a seeded SQLite database for the product search
+# filters and the foreign key lookups, and exits non-zero if any of them would
+# scan a table instead of seeking an index (or, for the ?q= prefix search, stops
+# compiling to the LIKE MySQL can range scan).
+#
+#   python benchmarks/check_query_plans.py --rows 20000
+import argparse
+import os
+import sys
+import tempfile
+
+from sqlalchemy import create_engine, func, insert, select, text
+from sqlalchemy.dialects.mysql import dialect as mysql_dialect
+
+# the app's own engine is not used here, keep it off the production database
+os.environ.setdefault('FLASK_SQLALCHEMY_DATABASE_URI', 'sqlite://')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import (app, Base, User, Order, Product, order_product, filter_products,
+                 PRODUCT_COLUMNS, ORDER_COLUMNS)
+
+
+def seed(engine, rows):
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{'name': f'user {i}', 'address': 'x', 'email': f'user{i}@example.com', 'password': 'x'}
+                                    for i in range(rows // 10)])
+        conn.execute(insert(Product), [{'product_name': f'product {i}', 'price': i % 500 / 3} for i in range(rows)])
+        conn.execute(insert(Order), [{'user_id': 1 + i % (rows // 10)} for i in range(rows)])
+        conn.execute(insert(order_product), [{'order_id': 1 + i, 'product_id': 1 + i * 7 % rows} for i in range(rows)])
+        # give the planner real statistics, as a production database would have
+        conn.execute(text('ANALYZE'))
+
+
+def product_search(url):
+    with app.test_request_context(url):
+        return filter_products(select(*PRODUCT_COLUMNS))
+
+
+# (name, statement, index the plan must use); None for the ?q= prefix search, which is
+# LIKE 'q%' ESCAPE '/' so MySQL range scans ix_products_product_name, but SQLite only
+# turns LIKE into an index range for a NOCASE column and never with an ESCAPE clause
+def checks():
+    return [
+        ('GET /products?q=', product_search('/products?q=product 12'), None),
+        ('GET /products?min_price=&max_price=', product_search('/products?min_price=10&max_price=12'), 'ix_products_price'),
+        ('GET /products?sort=price', product_search('/products?sort=price'), 'ix_products_price'),
+        ('GET /products?min_price=&sort=-price', product_search('/products?min_price=150&sort=-price'), 'ix_products_price'),
+        ('GET /orders/user/<id>', select(*ORDER_COLUMNS).where(Order.user_id == 7).order_by(Order.id), 'ix_orders_user_id'),
+        ('GET /orders/<id>/products', select(*PRODUCT_COLUMNS).where(order_product.c.order_id == 7, Product.id == order_product.c.product_id),
+         'sqlite_autoindex_order_product_1'),
+        ('buyers of a product', select(Order.user_id).join(order_product, Order.id == order_product.c.order_id)
+         .where(order_product.c.product_id == 7), 'ix_order_product_product_id'),
+        ('user spend', select(func.coalesce(func.sum(Product.price), 0)).select_from(Order)
+         .join(order_product, Order.id == order_product.c.order_id).join(Product, Product.id == order_product.c.product_id)
+         .where(Order.user_id == 7), 'ix_orders_user_id'),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'plans.db')}")
+        Base.metadata.create_all(engine)
+        seed(engine, args.rows)
+        with engine.connect() as conn:
+            for name, statement, index in checks():
+                sql = str(statement.compile(engine, compile_kwargs={'literal_binds': True}))
+                plan = [row[-1] for row in conn.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+                if index is None:
+                    # the prefix must reach MySQL as a plain LIKE on the indexed column
+                    mysql = str(statement.compile(dialect=mysql_dialect(), compile_kwargs={'literal_binds': True}))
+                    ok = 'products.product_name LIKE concat(' in mysql
+                    print(f"{'ok  ' if ok else 'FAIL'} {name} (LIKE prefix, SQLite scans it)")
+                    for step in plan:
+                        print(f"       {step}")
+                    if not ok:
+                        failures.append(name)
+                    continue
+                # "SCAN products" is a table scan, "SCAN products USING INDEX ..." walks an index in order
+                scans = [step for step in plan if step.startswith('SCAN') and 'INDEX' not in step]
+                ok = not scans and any(index in step for step in plan)
+                print(f"{'ok  ' if ok else 'FAIL'} {name}")
+                for step in plan:
+                    print(f"       {step}")
+                if not ok:
+                    failures.append(name)
+        engine.dispose()
+
+    if failures:
+        sys.exit(f"table scans or missing indexes for: {', '.join(failures)}")
+
+
+if __name__ == '__main__':
+    main()